@@ -2,7 +2,9 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from datetime import date
+from database_process import GpuDatabase
 import os
 
 
@@ -16,6 +18,8 @@ import os
 # table - table of chosen database where data should be stored
 # host - host of the database
 # engine_str - optional parameter for non MySQL users, valid sqlalchemy create_enginge string should be passed
+# months - optional, analyse only data from last given number of months, it uses date index of the table
+# so loading time doesn't grow with the size of whole table
 
 
 # next analysis is performed using pandas, matplotlib and seaborn
@@ -26,7 +30,7 @@ import os
 # if either parameter is set to "None", the corresponding file will not be saved and only the dashboard will be displayed
 # it is recommended to use Jupyter Notebook for better experience
 def gpu_analysis_dashboard(plot_name1=None,plot_name2=None,database_user=os.environ.get("DB_USER"), database_password=os.environ.get("DB_PASS"),
-                           database="gpu_monitoring", table="gpu_info", host="localhost",engine_str=None):
+                           database="gpu_monitoring", table="gpu_info", host="localhost",engine_str=None,months=None):
     # separate function to collect data from database
     # double underscore indicates that it is a private function
     def __load_from_db():
@@ -41,8 +45,13 @@ def gpu_analysis_dashboard(plot_name1=None,plot_name2=None,database_user=os.envi
             engine = create_engine(engine_str)
         connection = engine.connect()
         # load data using pandas and save it into variable
-        data = pd.read_sql(f"{table}", con=connection,
-                           columns=["model", "price_USD", "brand", "ram_GB", "gpu_clock_speed_MHz", "date"])
+        # table is selected with query because on SQLite it is a view over monthly tables (see database_process.py)
+        query = f"SELECT model, price_USD, brand, ram_GB, gpu_clock_speed_MHz, date FROM {table}"
+        if not months:
+            data = pd.read_sql(text(query), con=connection)
+        else:
+            since = GpuDatabase.month_start(date.today(), -months)
+            data = pd.read_sql(text(f"{query} WHERE date >= :since"), con=connection, params={"since": since})
         # after everything is read close the connection to database
         connection.close()
 
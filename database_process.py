@@ -0,0 +1,348 @@
+from sqlalchemy import create_engine, inspect, text, MetaData, Table, Column, Integer, Float, String, Date, Index, \
+    PrimaryKeyConstraint, select, insert, update, delete, func, and_
+from sqlalchemy.schema import CreateTable
+import pandas as pd
+import re
+import os
+from datetime import date
+
+"""""Database schema management of GPU monitoring data, project creates its own tables instead of relying on
+pandas "to_sql" which creates tables without primary key, indexes and with TEXT columns. Raw offers table is
+typed, indexed by date, brand and model and partitioned by month (MySQL range partitioning, on SQLite separate
+table for every month combined by a view), old months are downsampled to monthly aggregates and dropped
+so queries stay fast no matter how long the monitor is running."""
+
+# GpuDatabase class is responsible for structure of the database used by ETL and analysis parts of the project
+
+class GpuDatabase():
+    # class instance parameters:
+    # database_user - RDBMS instance user or login
+    # database_password - RDBMS instance password
+    # database - name of used database
+    # table - table of chosen database where data should be stored
+    # host - host of the database
+    # engine_str - optional parameter for non MySQL users, valid sqlalchemy create_enginge string should be passed
+    # months_ahead - how many future monthly partitions are created in advance
+
+    def __init__(self,database_user=os.environ.get("DB_USER"), database_password=os.environ.get("DB_PASS"),
+                 database="gpu_monitoring", table="gpu_info", host="localhost", engine_str=None, months_ahead=3):
+        # if engine parameter was not passed create engine based on parameters for MySQL
+        if not engine_str:
+            self.engine = create_engine(f'mysql+pymysql://{database_user}:{database_password}@{host}/{database}')
+        else:
+            self.engine = create_engine(engine_str)
+        self.is_mysql = self.engine.dialect.name == "mysql"
+        self.table = table
+        self.months_ahead = months_ahead
+        self.columns = ["model","price_USD","brand","ram_GB","gpu_clock_speed_MHz","date"]
+
+        # aggregates of downsampled months, one row for each brand and model in given month
+        self.aggregate = Table(f"{table}_monthly",MetaData(),
+                               Column("month",Date,nullable=False),
+                               Column("brand",String(255),nullable=False),
+                               Column("model",String(255),nullable=False),
+                               Column("snapshots",Integer,nullable=False),
+                               Column("offers",Integer,nullable=False),
+                               Column("price_USD_min",Float),
+                               Column("price_USD_avg",Float),
+                               Column("price_USD_max",Float),
+                               Column("ram_GB_avg",Float),
+                               Column("gpu_clock_speed_MHz_avg",Float),
+                               PrimaryKeyConstraint("month","brand","model"))
+        # names of legacy tables whose rows were already copied to managed table
+        self.migrations = Table(f"{table}_migrations",MetaData(),
+                                Column("name",String(255),primary_key=True))
+
+
+    # first day of the month "months" months after month of given day
+    @staticmethod
+    def month_start(day,months=0):
+        month_index = day.year*12 + day.month - 1 + months
+        return date(month_index//12,month_index%12 + 1,1)
+
+
+    # definition of raw offers table, on SQLite it's used for every monthly table
+    # MySQL requires partitioning column to be part of primary key so it is (id, date) there
+    # double underscore indicates that this should be private method
+    def __raw_table(self,name):
+        if self.is_mysql:
+            id_column = Column("id",Integer,autoincrement=True)
+            primary_key = PrimaryKeyConstraint("id","date")
+        else:
+            id_column = Column("id",Integer,primary_key=True,autoincrement=True)
+            primary_key = ()
+        table = Table(name,MetaData(),
+                      id_column,
+                      Column("model",String(255)),
+                      Column("price_USD",Float),
+                      Column("brand",String(255)),
+                      Column("ram_GB",Float),
+                      Column("gpu_clock_speed_MHz",Float),
+                      Column("date",Date,nullable=False),
+                      *primary_key)
+        # composite indexes for queries filtering by date, brand and model
+        Index(f"ix_{name}_date_brand_model",table.c.date,table.c.brand,table.c.model)
+        Index(f"ix_{name}_brand_model_date",table.c.brand,table.c.model,table.c.date)
+        return table
+
+
+    # name of partition (MySQL) or monthly table (SQLite) holding given month
+    def __partition_name(self,month):
+        if self.is_mysql:
+            return f"p{month:%Y%m}"
+        return f"{self.table}_p{month:%Y%m}"
+
+
+    # list of months which have their partition, sorted from the oldest
+    # conn - optional connection, used on SQLite to see tables created in not yet committed transaction
+    def partitions(self,conn=None):
+        if self.is_mysql:
+            # MySQL commits partitioning changes immediately so separate connection is fine
+            with self.engine.connect() as mysql_conn:
+                names = mysql_conn.execute(text("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                                                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"),
+                                           {"table": self.table}).scalars().all()
+            pattern = re.compile(r"p(\d{4})(\d{2})$")
+        else:
+            names = inspect(conn if conn is not None else self.engine).get_table_names()
+            pattern = re.compile(re.escape(self.table) + r"_p(\d{4})(\d{2})$")
+        months = []
+        for name in names:
+            match = pattern.match(name or "")
+            if match:
+                months.append(date(int(match.group(1)),int(match.group(2)),1))
+        return sorted(months)
+
+
+    # on SQLite "table" is a view combining all monthly tables, it has to be rebuilt when monthly table is added or dropped
+    # "id" is unique only inside single monthly table so it isn't part of the view
+    # double underscore indicates that this should be private method
+    def __rebuild_view(self,conn):
+        columns = ", ".join(self.columns)
+        selects = [f'SELECT {columns} FROM "{self.__partition_name(month)}"' for month in self.partitions(conn)]
+        conn.execute(text(f'DROP VIEW IF EXISTS "{self.table}"'))
+        if selects:
+            conn.execute(text(f'CREATE VIEW "{self.table}" AS ' + " UNION ALL ".join(selects)))
+
+
+    # make sure every month from "first_month" until "months_ahead" months from now (or "last_month"
+    # if it is later) has its partition
+    def ensure_partitions(self,first_month=None,last_month=None):
+        existing = self.partitions()
+        first_month = self.month_start(first_month or date.today())
+        last_month = max(self.month_start(date.today(),self.months_ahead),first_month,
+                         self.month_start(last_month or first_month))
+
+        if self.is_mysql:
+            # rows older than first partition's month are stored in it, so only newer partitions can be added
+            # they are split from "pmax" partition which catches all rows after the last month
+            month = self.month_start(existing[-1],1) if existing else first_month
+            with self.engine.begin() as conn:
+                while month <= last_month:
+                    conn.execute(text(f"ALTER TABLE `{self.table}` REORGANIZE PARTITION pmax INTO ("
+                                      f"PARTITION {self.__partition_name(month)} VALUES LESS THAN ('{self.month_start(month,1)}'), "
+                                      f"PARTITION pmax VALUES LESS THAN MAXVALUE)"))
+                    month = self.month_start(month,1)
+        else:
+            month = min([first_month] + existing)
+            with self.engine.begin() as conn:
+                while month <= last_month:
+                    if month not in existing:
+                        self.__raw_table(self.__partition_name(month)).create(conn)
+                    month = self.month_start(month,1)
+                self.__rebuild_view(conn)
+
+
+    # check if rows of legacy table were already copied to managed table
+    # double underscore indicates that this should be private method
+    def __is_migrated(self,legacy):
+        with self.engine.connect() as conn:
+            return conn.execute(select(self.migrations.c.name).where(self.migrations.c.name == legacy)).first() is not None
+
+
+    # create tables used by the project, if table was created earlier by pandas "to_sql" its data is migrated
+    def create_schema(self):
+        self.aggregate.create(self.engine,checkfirst=True)
+        self.migrations.create(self.engine,checkfirst=True)
+        table_names = set(inspect(self.engine).get_table_names())
+        legacy = f"{self.table}_legacy"
+
+        # table created by pandas has no "id" column, it is renamed and kept as a backup of migrated data
+        # on SQLite managed table is a view so it isn't listed in table names, on MySQL managed table is partitioned
+        if self.table in table_names and not self.partitions():
+            with self.engine.begin() as conn:
+                if self.is_mysql:
+                    conn.execute(text(f"RENAME TABLE `{self.table}` TO `{legacy}`"))
+                else:
+                    conn.execute(text(f'ALTER TABLE "{self.table}" RENAME TO "{legacy}"'))
+            table_names.discard(self.table)
+            table_names.add(legacy)
+
+        # legacy rows are copied until migration is recorded, so migration interrupted at any point
+        # is finished by the next run
+        migrate = legacy in table_names and not self.__is_migrated(legacy)
+
+        # partitions have to cover all migrated data
+        first_month = date.today()
+        last_month = None
+        if migrate:
+            with self.engine.connect() as conn:
+                dates = pd.to_datetime(pd.read_sql(text(f"SELECT date FROM {legacy}"),conn)["date"],errors="coerce").dropna()
+            if len(dates) > 0:
+                first_month = dates.min().date()
+                last_month = dates.max().date()
+
+        if self.is_mysql and self.table not in table_names:
+            # partitioned table has to be created with at least one partition, next ones are added by "ensure_partitions"
+            table = self.__raw_table(self.table)
+            month = self.month_start(first_month)
+            with self.engine.begin() as conn:
+                conn.execute(text(str(CreateTable(table).compile(self.engine)).rstrip() +
+                                  f" PARTITION BY RANGE COLUMNS(`date`) ("
+                                  f"PARTITION {self.__partition_name(month)} VALUES LESS THAN ('{self.month_start(month,1)}'), "
+                                  f"PARTITION pmax VALUES LESS THAN MAXVALUE)"))
+                for index in table.indexes:
+                    index.create(conn)
+        self.ensure_partitions(first_month,last_month)
+
+        if migrate:
+            # all rows and migration record are inserted in one transaction, if it fails nothing is copied
+            with self.engine.begin() as conn:
+                for chunk in pd.read_sql(text(f"SELECT {', '.join(self.columns)} FROM {legacy}"),conn,chunksize=10000):
+                    # values loaded by pandas were stored as text, "unknown" and other non numeric values become NULL
+                    for column in ["price_USD","ram_GB","gpu_clock_speed_MHz"]:
+                        chunk[column] = pd.to_numeric(chunk[column],errors="coerce")
+                    chunk["date"] = pd.to_datetime(chunk["date"],errors="coerce")
+                    self.__insert(conn,self.__prepare(chunk.dropna(subset=["date"])))
+                conn.execute(insert(self.migrations).values(name=legacy))
+
+
+    # convert data to types of raw offers table
+    # double underscore indicates that this should be private method
+    def __prepare(self,data):
+        data = data[self.columns].copy()
+        data["date"] = pd.to_datetime(data["date"]).dt.date
+        # NaN values are inserted as NULL
+        return data.astype(object).where(pd.notnull(data),None)
+
+
+    # insert prepared data using given connection, partitions have to exist already
+    # double underscore indicates that this should be private method
+    def __insert(self,conn,data):
+        if data.empty:
+            return
+        # MySQL routes rows to partitions itself, on SQLite rows are inserted into table of their month
+        if self.is_mysql:
+            groups = [(self.table,data)]
+        else:
+            groups = [(self.__partition_name(month),rows) for month, rows in
+                      data.groupby(data["date"].apply(self.month_start))]
+        for name, rows in groups:
+            conn.execute(insert(self.__raw_table(name)),rows.to_dict("records"))
+
+
+    # insert cleaned data returned by AmazonScrapeGPU "get_gpu_data" function, returns number of inserted rows
+    def load(self,data):
+        data = self.__prepare(data)
+        if data.empty:
+            return 0
+        self.ensure_partitions(min(data["date"]),max(data["date"]))
+        with self.engine.begin() as conn:
+            self.__insert(conn,data)
+        return len(data)
+
+
+    # weighted average of existing aggregate and new rows, missing average is ignored
+    @staticmethod
+    def __combine_avg(old_avg,old_count,new_avg,new_count):
+        if old_avg is None:
+            return new_avg
+        if new_avg is None:
+            return old_avg
+        return (old_avg*old_count + new_avg*new_count)/(old_count + new_count)
+
+
+    # add rows of given month to monthly aggregates using given connection
+    # month may have been downsampled before (e.g. data was backfilled later), so existing aggregates are combined
+    # with new rows instead of being replaced
+    # double underscore indicates that this should be private method
+    def __downsample(self,conn,source,month,in_month):
+        brand = func.coalesce(source.c.brand,"unknown")
+        model = func.coalesce(source.c.model,"unknown")
+        new_rows = conn.execute(select(brand,model,
+                                       func.count(func.distinct(source.c.date)),func.count(),
+                                       func.min(source.c.price_USD),func.avg(source.c.price_USD),func.max(source.c.price_USD),
+                                       func.avg(source.c.ram_GB),func.avg(source.c.gpu_clock_speed_MHz))
+                                .where(in_month).group_by(brand,model)).all()
+        aggregate = self.aggregate.c
+        for brand, model, snapshots, offers, price_min, price_avg, price_max, ram_avg, clock_avg in new_rows:
+            key = and_(aggregate.month == month,aggregate.brand == brand,aggregate.model == model)
+            old = conn.execute(select(self.aggregate).where(key)).mappings().first()
+            if old is None:
+                conn.execute(insert(self.aggregate).values(month=month,brand=brand,model=model,snapshots=snapshots,
+                                                           offers=offers,price_USD_min=price_min,price_USD_avg=price_avg,
+                                                           price_USD_max=price_max,ram_GB_avg=ram_avg,
+                                                           gpu_clock_speed_MHz_avg=clock_avg))
+                continue
+            # backfilled rows usually come from snapshot which wasn't downsampled yet, so snapshots are added up
+            conn.execute(update(self.aggregate).where(key).values(
+                snapshots=old["snapshots"] + snapshots,
+                offers=old["offers"] + offers,
+                price_USD_min=min([value for value in [old["price_USD_min"],price_min] if value is not None],default=None),
+                price_USD_avg=self.__combine_avg(old["price_USD_avg"],old["offers"],price_avg,offers),
+                price_USD_max=max([value for value in [old["price_USD_max"],price_max] if value is not None],default=None),
+                ram_GB_avg=self.__combine_avg(old["ram_GB_avg"],old["offers"],ram_avg,offers),
+                gpu_clock_speed_MHz_avg=self.__combine_avg(old["gpu_clock_speed_MHz_avg"],old["offers"],clock_avg,offers)))
+
+
+    # downsample months older than "months" months into monthly aggregates table and drop their raw rows
+    # archive - if True raw rows are saved to csv file before being dropped, like data that couldn't be loaded to database
+    # returns summary which is attached to email report
+    def apply_retention(self,months=24,archive=True):
+        cutoff = self.month_start(date.today(),-months)
+        dropped_months = 0
+        # months are processed from the oldest, on MySQL oldest partition holds also rows older than its month
+        # so every partition is checked for rows of all months before its end
+        for partition in self.partitions():
+            if partition >= cutoff:
+                break
+            if self.is_mysql:
+                source = self.__raw_table(self.table)
+            else:
+                source = self.__raw_table(self.__partition_name(partition))
+            in_partition = source.c.date < self.month_start(partition,1)
+            with self.engine.connect() as conn:
+                dates = conn.execute(select(source.c.date).distinct().where(in_partition)).scalars().all()
+            data_months = sorted({self.month_start(day) for day in dates})
+
+            # raw rows are archived first, if anything fails later they are still in the database
+            # archive of the month is appended to because the month might have been backfilled after it was dropped
+            if archive:
+                for month in data_months:
+                    in_month = and_(source.c.date >= month,source.c.date < self.month_start(month,1))
+                    raw = pd.read_sql(select(*[source.c[column] for column in self.columns]).where(in_month),self.engine)
+                    path = f"{self.table}_archive_{month:%Y%m}.csv"
+                    if os.path.isfile(path):
+                        raw.to_csv(path,na_rep="NaN",mode="a",header=False,index=False)
+                    else:
+                        raw.to_csv(path,na_rep="NaN",mode="w",index=False)
+
+            # aggregates are updated in the same transaction in which raw rows are removed, so rows can't be counted twice
+            with self.engine.begin() as conn:
+                for month in data_months:
+                    in_month = and_(source.c.date >= month,source.c.date < self.month_start(month,1))
+                    self.__downsample(conn,source,month,in_month)
+                if self.is_mysql:
+                    conn.execute(delete(source).where(in_partition))
+                else:
+                    conn.execute(text(f'DROP TABLE "{self.__partition_name(partition)}"'))
+                    self.__rebuild_view(conn)
+            # MySQL drops partition in its own implicit transaction, it's already empty
+            if self.is_mysql:
+                with self.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE `{self.table}` DROP PARTITION {self.__partition_name(partition)}"))
+            dropped_months += 1
+
+        if dropped_months:
+            return f"Retention: {dropped_months} months older than {cutoff:%Y-%m} downsampled to {self.aggregate.name} and raw rows dropped\n"
+        return ""
@@ -0,0 +1,256 @@
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Float, String, Text, \
+    PrimaryKeyConstraint, select, update, insert, func, case, or_, and_
+from sqlalchemy.exc import IntegrityError
+from urllib.parse import quote_plus
+import pandas as pd
+import argparse
+import hashlib
+import random
+import time
+from datetime import date
+from etl_process import AmazonScrapeGPU
+
+"""""Sharded crawling of several Amazon categories and search queries by many workers at the same time.
+Coordinator expands queries into listing page work items stored in shared queue, workers lease items,
+listing pages are expanded into individual sale offer items and scraped offers are stored as results
+deduplicated by ASIN and date, at the end results are merged and loaded to database like in single process ETL."""
+
+# CrawlQueue class is durable work queue shared by coordinator and workers
+
+class CrawlQueue():
+    # class instance parameters:
+    # engine_str - valid sqlalchemy create_enginge string of database storing the queue
+    # - by default local SQLite file is used, which is enough for many workers on one machine
+    # - to spread workers across machines point all of them to the same server database (e.g. MySQL)
+    # max_attempts - how many times single item can be leased before it is marked as failed
+
+    def __init__(self,engine_str="sqlite:///crawl_queue.db",max_attempts=3):
+        # SQLite locks whole file during writes, wait for other workers instead of failing immediately
+        if engine_str.startswith("sqlite"):
+            self.engine = create_engine(engine_str,connect_args={"timeout":30})
+        else:
+            self.engine = create_engine(engine_str)
+        self.max_attempts = max_attempts
+
+        metadata = MetaData()
+        # work items, "item_key" makes seeding and expanding pages idempotent
+        # status is one of: "pending", "leased", "done", "failed"
+        self.items = Table("crawl_items",metadata,
+                           Column("id",Integer,primary_key=True,autoincrement=True),
+                           Column("item_key",String(255),nullable=False,unique=True),
+                           Column("run_date",String(10),nullable=False,index=True),
+                           Column("kind",String(5),nullable=False),
+                           Column("query",String(255),nullable=False),
+                           Column("page",Integer),
+                           Column("asin",String(40)),
+                           Column("url",Text,nullable=False),
+                           Column("status",String(10),nullable=False,default="pending",index=True),
+                           Column("lease_owner",String(255)),
+                           Column("lease_expires",Float,nullable=False,default=0),
+                           Column("attempts",Integer,nullable=False,default=0),
+                           Column("last_error",Text))
+        # scraped offers, primary key on ASIN and date deduplicates offers found by different queries or workers
+        # "merged" is set when offer was loaded to database so merging the same date again doesn't duplicate it
+        self.results = Table("crawl_results",metadata,
+                             Column("asin",String(40),nullable=False),
+                             Column("date",String(10),nullable=False),
+                             Column("query",String(255)),
+                             Column("model",String(255)),
+                             Column("price_USD",String(255)),
+                             Column("brand",String(255)),
+                             Column("ram_GB",String(255)),
+                             Column("gpu_clock_speed_MHz",String(255)),
+                             Column("worker",String(255)),
+                             Column("merged",Integer,nullable=False,default=0),
+                             PrimaryKeyConstraint("asin","date"))
+        metadata.create_all(self.engine)
+
+
+    # insert single work item, items which are already in the queue are ignored
+    # double underscore indicates that this should be private method
+    def __put(self,**item):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(self.items).values(status="pending",lease_expires=0,attempts=0,**item))
+            return True
+        except IntegrityError:
+            return False
+
+
+    # expand queries into listing page items for given date
+    # queries - dictionary of query name and Amazon listing url or list of search phrases (or urls)
+    # returns number of newly added items
+    def seed(self,queries,number_of_pages=40,starting_page=1,run_date=None):
+        if not run_date:
+            run_date = date.today().strftime('%Y-%m-%d')
+        if not isinstance(queries,dict):
+            queries = {query: query for query in queries}
+
+        added = 0
+        for name, url in queries.items():
+            # plain search phrase is turned into Amazon search url in electronics section
+            if not url.startswith("http"):
+                url = f"https://www.amazon.com/s?k={quote_plus(url)}&i=electronics"
+            for page in range(starting_page,starting_page + number_of_pages):
+                added += self.__put(item_key=f"page:{run_date}:{name}:{page}",run_date=run_date,kind="page",
+                                    query=name,page=page,url=f"{url}&page={page}")
+        return added
+
+
+    # add sale offers found on leased listing page, offers are keyed by ASIN so offer found
+    # by several queries is scraped only once
+    # offers - list of (ASIN, url) pairs
+    def put_offers(self,page_item,offers):
+        added = 0
+        for asin, url in offers:
+            # if ASIN couldn't be found use hash of the url instead
+            key = asin if asin else hashlib.sha1(url.encode()).hexdigest()
+            added += self.__put(item_key=f"offer:{page_item['run_date']}:{key}",run_date=page_item["run_date"],
+                                kind="offer",query=page_item["query"],page=page_item["page"],asin=key,url=url)
+        return added
+
+
+    # lease next available item for "visibility_timeout" seconds, returns item as dictionary or None if
+    # there is no available item, item is available if it is pending or its previous lease expired
+    # run_date - optional, lease only items of given date
+    def lease(self,worker_id,visibility_timeout=300,run_date=None):
+        now = time.time()
+        available = or_(self.items.c.status == "pending",
+                        and_(self.items.c.status == "leased",self.items.c.lease_expires < now))
+        if run_date:
+            available = and_(self.items.c.run_date == run_date,available)
+        with self.engine.begin() as conn:
+            # expired leases which used all attempts won't be retried anymore
+            conn.execute(update(self.items)
+                         .where(and_(self.items.c.status == "leased",self.items.c.lease_expires < now,
+                                     self.items.c.attempts >= self.max_attempts))
+                         .values(status="failed",lease_owner=None))
+
+        # if all candidates were claimed by other workers meanwhile, next ones are fetched
+        # so worker gets None only when there is really no available item
+        while True:
+            with self.engine.connect() as conn:
+                # listing pages go first so they are expanded into offers for other workers as soon as possible
+                candidates = conn.execute(select(self.items.c.id,self.items.c.kind).where(available)
+                                          .order_by(self.items.c.kind.desc(),self.items.c.id).limit(20)).all()
+            if not candidates:
+                return None
+
+            # pick candidates of the first kind in random order so concurrent workers don't compete for the same item
+            candidates = [item_id for item_id, kind in candidates if kind == candidates[0].kind]
+            random.shuffle(candidates)
+            for item_id in candidates:
+                with self.engine.begin() as conn:
+                    # conditional update succeeds only for one worker, others just try next candidate
+                    claimed = conn.execute(update(self.items)
+                                           .where(and_(self.items.c.id == item_id,available))
+                                           .values(status="leased",lease_owner=worker_id,
+                                                   lease_expires=now + visibility_timeout,
+                                                   attempts=self.items.c.attempts + 1))
+                    if claimed.rowcount == 1:
+                        return dict(conn.execute(select(self.items).where(self.items.c.id == item_id)).mappings().one())
+
+
+    # mark item as done, it's ignored if lease was meanwhile taken over by other worker
+    def complete(self,item_id,worker_id):
+        with self.engine.begin() as conn:
+            conn.execute(update(self.items)
+                         .where(and_(self.items.c.id == item_id,self.items.c.lease_owner == worker_id,
+                                     self.items.c.status == "leased"))
+                         .values(status="done",lease_expires=0))
+
+
+    # return item to the queue so it can be retried or mark it as failed if it used all attempts
+    # retry - if False item is marked as failed immediately (e.g. page past the end of the listing)
+    def fail(self,item_id,worker_id,error=None,retry=True):
+        if retry:
+            status = case((self.items.c.attempts >= self.max_attempts,"failed"),else_="pending")
+        else:
+            status = "failed"
+        with self.engine.begin() as conn:
+            conn.execute(update(self.items)
+                         .where(and_(self.items.c.id == item_id,self.items.c.lease_owner == worker_id,
+                                     self.items.c.status == "leased"))
+                         .values(status=status,
+                                 lease_owner=None,lease_expires=0,last_error=error))
+
+
+    # store scraped offer, offer already scraped for the same ASIN and date is ignored
+    # row - [model, price, brand, ram, gpu_clock_speed, date] as scraped by AmazonScrapeGPU
+    def add_result(self,item,row,worker_id=None):
+        model, price, brand, ram, gpu_clock_speed = row[:5]
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(self.results).values(asin=item["asin"],date=item["run_date"],query=item["query"],
+                                                         model=model,price_USD=price,brand=brand,ram_GB=ram,
+                                                         gpu_clock_speed_MHz=gpu_clock_speed,
+                                                         worker=worker_id or item["lease_owner"]))
+            return True
+        except IntegrityError:
+            return False
+
+
+    # results of all workers for given date which weren't loaded to database yet
+    # in the same format as AmazonScrapeGPU "data_frame", indexed by ASIN
+    def results_frame(self,run_date):
+        columns = ["model","price_USD","brand","ram_GB","gpu_clock_speed_MHz","date"]
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(self.results.c.asin,*[self.results.c[column] for column in columns])
+                                .where(and_(self.results.c.date == run_date,self.results.c.merged == 0))
+                                .order_by(self.results.c.asin)).all()
+        return pd.DataFrame([list(row[1:]) for row in rows],columns=columns,
+                            index=pd.Index([row[0] for row in rows],name="asin"))
+
+
+    # mark offers of given date as loaded to database
+    def mark_merged(self,run_date,asins):
+        asins = list(asins)
+        with self.engine.begin() as conn:
+            # update in batches to stay below limit of query parameters
+            for start in range(0,len(asins),500):
+                conn.execute(update(self.results)
+                             .where(and_(self.results.c.date == run_date,self.results.c.asin.in_(asins[start:start + 500])))
+                             .values(merged=1))
+
+
+    # number of items in each status, used in email report
+    def stats(self,run_date=None):
+        query = select(self.items.c.status,func.count()).group_by(self.items.c.status)
+        if run_date:
+            query = query.where(self.items.c.run_date == run_date)
+        with self.engine.connect() as conn:
+            return {status: count for status, count in conn.execute(query).all()}
+
+
+
+# command line interface, every step can be run on a different machine e.g.:
+# python distributed_process.py seed --query "rtx 4090" --query "radeon rx 7900" --pages 20
+# python distributed_process.py work (on as many machines as needed)
+# python distributed_process.py merge
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded GPU offers crawling coordinated through shared work queue")
+    parser.add_argument("command",choices=["seed","work","merge"])
+    parser.add_argument("--queue",default="sqlite:///crawl_queue.db",help="sqlalchemy engine string of the queue database")
+    parser.add_argument("--query",action="append",help="search phrase or Amazon listing url, can be repeated")
+    parser.add_argument("--pages",type=int,default=40,help="number of listing pages per query")
+    parser.add_argument("--starting-page",type=int,default=1)
+    parser.add_argument("--date",default=None,help="date of the run, today by default")
+    parser.add_argument("--worker-id",default=None)
+    parser.add_argument("--visibility-timeout",type=int,default=300)
+    parser.add_argument("--force",action="store_true",help="merge even if some work items are still pending or leased")
+    args = parser.parse_args()
+
+    crawl_queue = CrawlQueue(args.queue)
+    if args.command == "seed":
+        # without any query track the same listing as single process pipeline
+        queries = args.query if args.query else {"default": AmazonScrapeGPU().base_url}
+        print(f"Added {crawl_queue.seed(queries,args.pages,args.starting_page,args.date)} work items")
+    elif args.command == "work":
+        scraper = AmazonScrapeGPU()
+        scraper.run_worker(crawl_queue,args.worker_id,args.visibility_timeout,run_date=args.date)
+        print(scraper.email_message)
+    else:
+        scraper = AmazonScrapeGPU()
+        if args.date:
+            scraper.date = args.date
+        scraper.run_merge_pipeline(crawl_queue,args.force)
@@ -5,11 +5,12 @@ import time
 from datetime import date
 import random
 import numpy as np
-from sqlalchemy import create_engine
+from database_process import GpuDatabase
 import os
 from email.message import EmailMessage
 import ssl
 import smtplib
+import socket
 
 """""Monitoring graphics processing unit prices by web scraping Amazon sale offers and fetching data about individual CPUs,
 such as model name, price in USD, brand, graphics RAM size in gigabytes, GPU clock speed in megahertz, 
@@ -40,12 +41,14 @@ class AmazonScrapeGPU():
     # table - table of chosen database where data should be stored
     # host - host of the database
     # engine - optional parameter for non MySQL users, valid sqlalchemy create_enginge string should be passed
+    # retention_months - optional, after loading data months older than that are downsampled to monthly aggregates
+    # and their raw rows are archived to csv files and dropped (see database_process.py)
 
     def __init__(self,number_of_pages=40,starting_page=1,headers="unchanged",base_url="unchanged",
                 email = os.environ.get("email"),email_pass=os.environ.get("email_pass")
                  ,database_user=os.environ.get("DB_USER"), database_password=os.environ.get("DB_PASS"),
-                 database="gpu_monitoring", table="gpu_info", host="localhost", engine_str=None
-                 ):
+                 database="gpu_monitoring", table="gpu_info", host="localhost", engine_str=None,
+                 retention_months=None):
 
         #"the actual values of 'headers' and 'base_url' are not assigned as default parameters only for readability"
         #"these values are quite long"
@@ -94,13 +97,17 @@ class AmazonScrapeGPU():
         self.database = database
         self.database_password = database_password
         self.database_user = database_user
+        self.retention_months = retention_months
 
 
     # --------------------------THIS IS "EXTRACT" PART OF THE PROJECT--------------------------
 
     # scraping individual sale offer
     # double underscore indicates that this should be private method
-    def __get_gpu_info(self,url):
+    # raise_errors - if True connection errors are re-raised after being reported, used by distributed workers
+    # so a failed offer can be returned to the work queue instead of being lost
+    # returns scraped row or None if nothing was scraped
+    def __get_gpu_info(self,url,raise_errors=False):
         print("get gpu info")
         #making random break in running script to avoid being detected as a scraper by the website
         time.sleep(random.randint(2, 10))
@@ -114,10 +121,16 @@ class AmazonScrapeGPU():
         # to be informed that something went wrong at some point
         except requests.exceptions.ConnectionError as connection_error:
             self.email_message+= f'Get GPU info:{url} connection error occurred: {connection_error}"\n'
+            if raise_errors:
+                raise
         except requests.exceptions.Timeout as timeout_error:
             self.email_message+= f'Get GPU info:{url} timeout error occurred: {timeout_error}\n'
+            if raise_errors:
+                raise
         except requests.exceptions.RequestException as request_error:
             self.email_message+= f'Get GPU info:{url} an error occurred: {request_error}\n'
+            if raise_errors:
+                raise
         else:
             # check if website's response is ok
             if r.status_code < 300 and r.status_code > 100:
@@ -173,7 +186,9 @@ class AmazonScrapeGPU():
                             gpu_clock_speed = gpu_clock_speed_info[1].text
 
                     # append gathered data to main storage DataFrame
-                    self.data_frame.loc[len(self.data_frame.index)] = [model,price,brand,ram,gpu_clock_speed,self.date]
+                    row = [model,price,brand,ram,gpu_clock_speed,self.date]
+                    self.data_frame.loc[len(self.data_frame.index)] = row
+                    return row
 
             # in case if error 401 or 403 occured script will be stopped, it means that probably
             # Amazon blocked the script and there is no point in further scraping
@@ -185,6 +200,89 @@ class AmazonScrapeGPU():
             elif r.status_code == 403:
                 self.email_message+= f'Get GPU info:{url} access blocked by website (403)\n'
                 raise requests.exceptions.HTTPError('401 Unauthorized')
+            # Amazon usually responds to scrapers with 503 page, distributed worker stops then and leaves
+            # the item to workers with different IP, single process scraping just moves on to the next offer
+            elif r.status_code == 503 and raise_errors:
+                self.email_message+= f'Get GPU info:{url} access blocked by website (503)\n'
+                raise requests.exceptions.HTTPError('503 Service Unavailable',response=r)
+
+
+    # request single GPU listing page and return list of (ASIN, url) pairs of sale offers found on it
+    # returns None if the page couldn't be fetched, information about the error is attached to email report
+    # raise_errors - if True request errors are re-raised after being reported, used by distributed workers
+    # to decide whether item should be retried and whether worker should stop
+    # double underscore indicates that this should be private method
+    def __get_page_offers(self,page_link,current_page,raise_errors=False):
+        # use try statement to figure out what error might have occured to be informed in email message
+        # and not to crash whole script when error occurs just use data that was able to be scrapped
+        try:
+            r = requests.get(page_link,headers=self.headers)
+            r.raise_for_status()
+            # sleep random time interval to not get blocked by website as bot
+            time.sleep(random.randint(5,8))
+
+        # if connecting to main page failed stop the script it might suggest that we reached last page, or url is invalid
+        # or connection was blocked by amazon, either way there so point to continnue accessing another page
+
+        except requests.exceptions.ConnectionError as connection_error:
+            self.email_message+= f'Iterate pages: at page {current_page} connection error occurred: {connection_error}"\n'
+            if raise_errors:
+                raise
+            return None
+        except requests.exceptions.Timeout as timeout_error:
+            self.email_message+= f'Iterate pages: at page {current_page} timeout error occurred: {timeout_error}\n'
+            if raise_errors:
+                raise
+            return None
+        except requests.exceptions.RequestException as request_error:
+            self.email_message+= f'Iterate pages: at page {current_page} an error occurred: {request_error}\n'
+            if raise_errors:
+                raise
+            return None
+
+        # if status code is not 200 it might suggest that we reached last page, or url is invalid
+        # or connection was blocked by amazon, either way there so point to continnue accessing another page
+        # information about negative response which occured is attached to email report
+        if r.status_code == 400:
+            self.email_message+= f'Iterate pages:{current_page} invalid request\n'
+            return None
+        elif r.status_code == 401:
+            self.email_message+= f'Iterate pages:{current_page} access blocked by website (401)\n'
+            return None
+        elif r.status_code == 403:
+            self.email_message+= f'Iterate pages:{current_page} access blocked by website (403)\n'
+            return None
+        elif r.status_code == 404:
+            self.email_message+= f'Iterate pages:{current_page} page not found\n'
+            return None
+        elif r.status_code == 500:
+            self.email_message+= f'Iterate pages:{current_page} internal server error\n'
+            return None
+        elif not (r.status_code < 300 and r.status_code > 100):
+            self.email_message+= f'Iterate pages:{current_page} HTTP error occurred ({r.status_code})\n'
+            return None
+
+        offers = []
+        # load html content of the page
+        soup = BeautifulSoup(r.text,"lxml")
+
+        # get list of GPU sales
+        offers_list = soup.find("div",class_="s-main-slot s-result-list s-search-results sg-row")
+
+        # check if it was found
+        if offers_list:
+            # store every offer in list
+            offers_list = offers_list.find_all("div",class_="sg-col-20-of-24 s-result-item s-asin sg-col-0-of-12 sg-col-16-of-20 sg-col s-widget-spacing-small sg-col-12-of-16")
+            # fetch url to each offer
+            for offer in offers_list:
+                # get url
+                offer_link = offer.find("a")
+                # check if it was found
+                if offer_link:
+                    # ASIN (Amazon product identifier) is stored in "data-asin" attribute of every search result
+                    # it is used to deduplicate offers scraped by different workers
+                    offers.append((offer.get("data-asin"), f'https://amazon.com{offer_link["href"]}'))
+        return offers
 
 
     #go through all GPU listing pages, from "starting_page" parameter through "number_of_pages" next pages
@@ -197,75 +295,18 @@ class AmazonScrapeGPU():
             current_page=x
             # concat "base_url" which directs to GPU sales listing page and page index to request another page
             page_link = f"{self.base_url}&page={current_page}"
-            # use try statement to figure out what error might have occured to be informed in email message
-            # and not to crash whole script when error occurs just use data that was able to be scrapped
-            try:
-                r = requests.get(page_link,headers=self.headers)
-                r.raise_for_status()
-                # sleep random time interval to not get blocked by website as bot
-                time.sleep(random.randint(5,8))
-
-            # if connecting to main page failed stop the script it might suggest that we reached last page, or url is invalid
-            # or connection was blocked by amazon, either way there so point to continnue accessing another page
-
-            except requests.exceptions.ConnectionError as connection_error:
-                self.email_message+= f'Iterate pages: at page {current_page} connection error occurred: {connection_error}"\n'
-                break
-            except requests.exceptions.Timeout as timeout_error:
-                self.email_message+= f'Iterate pages: at page {current_page} timeout error occurred: {timeout_error}\n'
-                break
-            except requests.exceptions.RequestException as request_error:
-                self.email_message+= f'Iterate pages: at page {current_page} an error occurred: {request_error}\n'
+            offers = self.__get_page_offers(page_link,current_page)
+            # if page couldn't be fetched there is no point to continue accessing another page
+            if offers is None:
                 break
 
-            # conntinue if request didn't raise error
-            # information about error which occured is attached to email report
-            else:
-                # check if website's response is ok
-                if r.status_code < 300 and r.status_code > 100:
-                    # load html content of the page
-                    soup = BeautifulSoup(r.text,"lxml")
-
-                    # get list of GPU sales
-                    offers_list = soup.find("div",class_="s-main-slot s-result-list s-search-results sg-row")
-
-                    # check if it was found
-                    if offers_list:
-                        # store every offer in list
-                        offers_list = offers_list.find_all("div",class_="sg-col-20-of-24 s-result-item s-asin sg-col-0-of-12 sg-col-16-of-20 sg-col s-widget-spacing-small sg-col-12-of-16")
-                        # fetch url to each offer
-                        for offer in offers_list:
-                            # get url
-                            offer_link = offer.find("a")
-                            # check if it was found
-                            if offer_link:
-                                # use that url to fetch data about given graphics card
-                                try:
-                                    self.__get_gpu_info(f'https://amazon.com{offer_link["href"]}')
-
-                                # if error 401 or 403 o
-                                except requests.exceptions.HTTPError:
-                                    break
-                # if status code is not 200 it might suggest that we reached last page, or url is invalid
-                # or connection was blocked by amazon, either way there so point to continnue accessing another page
-                # information about negative response which occured is attached to email report
-                elif r.status_code == 400:
-                    self.email_message+= f'Iterate pages:{current_page} invalid request\n'
-                    break
-                elif r.status_code == 401:
-                    self.email_message+= f'Iterate pages:{current_page} access blocked by website (401)\n'
-                    break
-                elif r.status_code == 403:
-                    self.email_message+= f'Iterate pages:{current_page} access blocked by website (403)\n'
-                    break
-                elif r.status_code == 404:
-                    self.email_message+= f'Iterate pages:{current_page} page not found\n'
-                    break
-                elif r.status_code == 500:
-                    self.email_message+= f'Iterate pages:{current_page} internal server error\n'
-                    break
-                else:
-                    self.email_message+= f'Iterate pages:{current_page} HTTP error occurred ({r.status_code})\n'
+            for _, offer_url in offers:
+                # use that url to fetch data about given graphics card
+                try:
+                    self.__get_gpu_info(offer_url)
+
+                # if error 401 or 403 o
+                except requests.exceptions.HTTPError:
                     break
 
             # rotate user agent and the end of iteration to prevent website from blocking connection
@@ -376,6 +417,12 @@ class AmazonScrapeGPU():
     def get_gpu_data(self):
         # first fetch GPU data from Amazon pages
         self.__iterate_pages()
+        return self.__clean_collected_data()
+
+
+    # clean data stored in "data_frame" whether it was scraped locally or merged from distributed workers
+    # double underscore indicates that this should be private method
+    def __clean_collected_data(self):
         # clean that data but in case if something goes wrong return uncleaned data which is also good enough
         # data cleaning is in most cases manual job and it's hard to predict format of hundreds collected values
         # to automate that process but based on my research and tests "__prepare_data" function should work
@@ -410,27 +457,31 @@ class AmazonScrapeGPU():
     # table - table of chosen database where data should be stored
     # host - host of the database
     # engine_str - optional parameter for non MySQL users, valid sqlalchemy create_enginge string should be passed
-    def load_to_db(self):
+    # data - optional, already collected and prepared data, if not given it is scraped by get_gpu_data function
+    # returns True if data was loaded to database
+    def load_to_db(self,data=None):
         # using collected and prepared data
-        data = self.get_gpu_data()
+        if data is None:
+            data = self.get_gpu_data()
 
         # check if any data was returned at all
         if isinstance(data, pd.DataFrame):
             # try to connect to specified database
             try:
-                # if engine parameter was not passed create engine based on parameters for MySQL
-                if not self.engine_str:
-                # connecting using sqlalchemy package
-                    engine = create_engine(f'mysql+pymysql://{self.database_user}:{self.database_password}@{self.host}/{self.database}')
-                else:
-                    engine = create_engine(self.engine_str)
-                # insert data into the table, if table doesn't exist it will be created otherwhise data will be appended
+                # connecting using sqlalchemy package, if engine parameter was not passed engine is created
+                # based on parameters for MySQL
+                database = GpuDatabase(self.database_user,self.database_password,self.database,self.table,
+                                       self.host,self.engine_str)
+                engine = database.engine
                 # if data was cleaned successfully insert data into main table
+                # tables are created if they don't exist yet, table created by older versions is migrated
                 if self.is_data_cleaned:
-                    data.to_sql(name=self.table,con=engine,if_exists="append",index=False)
+                    database.create_schema()
+                    database.load(data)
                     self.email_message+= f"Successfully loaded {len(data)} rows  to database\n"
                     engine.dispose()
                 # otherwise insert data into backup table and store data for later manual cleaning
+                # if table doesn't exist it will be created otherwhise data will be appended
                 else:
                     data.to_sql(name=f'{self.table}_uncleaned', con=engine, if_exists="append", index=False)
                     self.email_message += f"Successfully loaded {len(data)} rows  to database (uncleaned table)\n"
@@ -448,6 +499,18 @@ class AmazonScrapeGPU():
                 # if file doesn't exist, create it
                 else:
                     data.to_csv(path,na_rep="NaN",mode="w",index=False)
+                return False
+
+            # retention runs only after data was loaded, so its failure can't affect already loaded data
+            else:
+                if self.is_data_cleaned and self.retention_months:
+                    try:
+                        self.email_message+= database.apply_retention(self.retention_months)
+                    except Exception as e:
+                        self.email_message+= f"Retention of old data failed - {e}, loaded data is not affected\n"
+                    engine.dispose()
+                return True
+        return False
 
 
     # this function wraps whole automated ETL process and executes it
@@ -458,6 +521,119 @@ class AmazonScrapeGPU():
 
 
 
+    # --------------------------THIS IS DISTRIBUTED CRAWLING PART OF THE PROJECT--------------------------
+
+    # work through items of shared CrawlQueue (see distributed_process.py) instead of contiguous page range
+    # many workers can run at the same time on different machines (e.g. behind different IP addresses)
+    # queue - CrawlQueue instance shared by coordinator and all workers
+    # worker_id - name of this worker stored with leased items, by default host name and process id
+    # visibility_timeout - seconds after which item leased by this worker becomes available again if it wasn't finished
+    # (e.g. worker crashed or was blocked)
+    # max_items - optional limit of items processed by this worker, by default work until queue is empty
+    # backoff - seconds to wait after failed item before leasing next one, doubled with every next failure in a row
+    # run_date - optional, work only on items of given date, by default on items of all dates
+    # poll_interval - seconds to wait when all remaining items are leased by other workers, they might expand
+    # pages into new offers or their leases might expire
+    def run_worker(self,queue,worker_id=None,visibility_timeout=300,max_items=None,backoff=30,run_date=None,
+                   poll_interval=30):
+        if not worker_id:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        # status codes meaning that website blocked this worker
+        blocked_status_codes = [401,403,503]
+        processed = 0
+        failures_in_row = 0
+        while max_items is None or processed < max_items:
+            item = queue.lease(worker_id,visibility_timeout,run_date)
+            if item is None:
+                stats = queue.stats(run_date)
+                # nothing left to do, every item is either finished or failed
+                if not stats.get("pending",0) and not stats.get("leased",0):
+                    break
+                # other workers still hold some items, wait for new offers or expired leases
+                time.sleep(poll_interval)
+                continue
+            processed += 1
+            print(item["kind"], item["url"])
+
+            # listing page items are expanded into offer items for any worker to pick up
+            if item["kind"] == "page":
+                try:
+                    offers = self.__get_page_offers(item["url"],item["page"],raise_errors=True)
+                except requests.exceptions.HTTPError as http_error:
+                    status_code = http_error.response.status_code if http_error.response is not None else None
+                    # access blocked, return item to the queue so worker with different IP can take it and stop this worker
+                    if status_code in blocked_status_codes:
+                        queue.fail(item["id"],worker_id,str(http_error))
+                        self.email_message+= f"Worker {worker_id} stopped, access blocked by website ({status_code})\n"
+                        break
+                    # page past the end of the listing, there is no point in retrying it
+                    elif status_code == 404:
+                        queue.fail(item["id"],worker_id,str(http_error),retry=False)
+                    else:
+                        queue.fail(item["id"],worker_id,str(http_error))
+                        failures_in_row += 1
+                # connection problems might be temporary, item will be retried later
+                except requests.exceptions.RequestException as request_error:
+                    queue.fail(item["id"],worker_id,str(request_error))
+                    failures_in_row += 1
+                else:
+                    if offers is None:
+                        queue.fail(item["id"],worker_id,f"page {item['page']} of {item['query']} couldn't be fetched")
+                        failures_in_row += 1
+                    else:
+                        queue.put_offers(item,offers)
+                        queue.complete(item["id"],worker_id)
+                        failures_in_row = 0
+            else:
+                try:
+                    row = self.__get_gpu_info(item["url"],raise_errors=True)
+                # access blocked, return item to the queue so worker with different IP can take it and stop this worker
+                except requests.exceptions.HTTPError as http_error:
+                    queue.fail(item["id"],worker_id,str(http_error))
+                    self.email_message+= f"Worker {worker_id} stopped, access blocked by website\n"
+                    break
+                # connection problems might be temporary, item will be retried later
+                except requests.exceptions.RequestException as request_error:
+                    queue.fail(item["id"],worker_id,str(request_error))
+                    failures_in_row += 1
+                else:
+                    if row:
+                        queue.add_result(item,row)
+                    queue.complete(item["id"],worker_id)
+                    failures_in_row = 0
+
+            # wait before leasing next item so single worker doesn't use up attempts of all items in a moment
+            if failures_in_row:
+                time.sleep(min(backoff*2**(failures_in_row - 1),600))
+
+            # rotate user agent after every item to prevent website from blocking connection
+            self.headers["User-Agent"] = self.user_agents_list[processed%len(self.user_agents_list)]
+
+        self.email_message+= f"Worker {worker_id} processed {processed} work items\n"
+
+
+    # merge results collected by all workers for this instance's date, results are deduplicated by ASIN and date
+    # then cleaned and loaded to database the same way as in run_etl_pipeline
+    # only offers which weren't loaded yet are merged, so merge can be safely repeated
+    # force - merge even if some work items are still pending or leased by workers
+    def run_merge_pipeline(self,queue,force=False):
+        stats = queue.stats(self.date)
+        outstanding = stats.get("pending",0) + stats.get("leased",0)
+        if outstanding and not force:
+            self.email_message+= f"Merge refused, {outstanding} work items are still pending or leased, queue status: {stats}\n"
+            self.send_email()
+            return
+
+        self.data_frame = queue.results_frame(self.date)
+        self.email_message+= f"Merged {len(self.data_frame)} unique offers from work queue, queue status: {stats}\n"
+        data = self.__clean_collected_data()
+        # offers are marked as merged only if they were loaded to database, otherwise next merge retries them
+        if isinstance(data, pd.DataFrame) and self.load_to_db(data):
+            queue.mark_merged(self.date,self.data_frame.index)
+        self.send_email()
+
+
+
 
 
 
@@ -0,0 +1,124 @@
+import pandas as pd
+import pytest
+from datetime import date
+from sqlalchemy import create_engine, inspect, text
+from database_process import GpuDatabase
+
+# tests of schema management, migration and retention, they use temporary SQLite file
+
+
+@pytest.fixture
+def engine_str(tmp_path,monkeypatch):
+    # archives of dropped months are saved to current directory
+    monkeypatch.chdir(tmp_path)
+    return f"sqlite:///{tmp_path / 'gpu.db'}"
+
+
+def offers(*rows):
+    return pd.DataFrame(list(rows),columns=["model","price_USD","brand","ram_GB","gpu_clock_speed_MHz","date"])
+
+
+def read(engine_str,query):
+    return pd.read_sql(text(query),create_engine(engine_str))
+
+
+@pytest.mark.parametrize("day,months,expected",[
+    (date(2026,1,15),0,date(2026,1,1)),
+    (date(2026,1,15),-1,date(2025,12,1)),
+    (date(2025,12,31),1,date(2026,1,1)),
+    (date(2026,3,1),-14,date(2025,1,1)),
+    (date(2026,3,1),22,date(2028,1,1)),
+])
+def test_month_start(day,months,expected):
+    assert GpuDatabase.month_start(day,months) == expected
+
+
+def test_load_creates_monthly_tables_and_view(engine_str):
+    database = GpuDatabase(engine_str=engine_str)
+    database.create_schema()
+    today = date.today()
+    last_month = GpuDatabase.month_start(today,-1)
+    assert database.load(offers(["RTX 4090",1299.0,"ASUS",24.0,None,str(today)],
+                                ["RX 7900",899.0,"XFX",20.0,2300.0,str(last_month)])) == 2
+
+    assert database.partitions()[0] == last_month
+    assert database.partitions()[-1] == GpuDatabase.month_start(today,database.months_ahead)
+    data = read(engine_str,"SELECT * FROM gpu_info ORDER BY date")
+    assert list(data.columns) == ["model","price_USD","brand","ram_GB","gpu_clock_speed_MHz","date"]
+    assert data["model"].tolist() == ["RX 7900","RTX 4090"]
+    index_names = [index["name"] for index in inspect(create_engine(engine_str)).get_indexes(f"gpu_info_p{today:%Y%m}")]
+    assert f"ix_gpu_info_p{today:%Y%m}_date_brand_model" in index_names
+
+
+def test_legacy_table_is_migrated_once(engine_str):
+    engine = create_engine(engine_str)
+    offers(["RTX 4090","1299","ASUS","24","unknown","2026-03-01"],
+           ["RX 7900","unknown","XFX","20","2300","2026-04-02"]).to_sql("gpu_info",engine,index=False)
+
+    database = GpuDatabase(engine_str=engine_str)
+    database.create_schema()
+    database.create_schema()
+    data = read(engine_str,"SELECT * FROM gpu_info ORDER BY date")
+    assert data["model"].tolist() == ["RTX 4090","RX 7900"]
+    assert data["price_USD"].isna().tolist() == [False,True]
+    assert data["gpu_clock_speed_MHz"].isna().tolist() == [True,False]
+    # original table is kept as backup
+    assert len(read(engine_str,"SELECT * FROM gpu_info_legacy")) == 2
+
+
+def test_interrupted_migration_is_finished(engine_str):
+    # run interrupted right after legacy table was renamed
+    offers(["RTX 4090","1299","ASUS","24","2500","2026-03-01"]).to_sql("gpu_info_legacy",create_engine(engine_str),index=False)
+
+    GpuDatabase(engine_str=engine_str).create_schema()
+    assert read(engine_str,"SELECT model FROM gpu_info")["model"].tolist() == ["RTX 4090"]
+
+
+def test_retention_aggregates_then_drops_old_months(engine_str,tmp_path):
+    database = GpuDatabase(engine_str=engine_str)
+    database.create_schema()
+    today = date.today()
+    old_month = GpuDatabase.month_start(today,-13)
+    database.load(offers(["RTX 4090",1000.0,"ASUS",24.0,2500.0,str(old_month)],
+                         ["RTX 4090",2000.0,"ASUS",24.0,2600.0,str(GpuDatabase.month_start(old_month,0).replace(day=15))],
+                         ["RX 7900",900.0,"XFX",20.0,2300.0,str(old_month)],
+                         ["RX 7900",950.0,"XFX",20.0,2300.0,str(today)]))
+
+    summary = database.apply_retention(12)
+    assert "1 months" in summary
+    assert database.partitions()[0] > old_month
+
+    aggregate = read(engine_str,"SELECT * FROM gpu_info_monthly ORDER BY model").set_index("model")
+    assert aggregate.loc["RTX 4090","offers"] == 2
+    assert aggregate.loc["RTX 4090","snapshots"] == 2
+    assert aggregate.loc["RTX 4090","price_USD_avg"] == 1500.0
+    assert aggregate.loc["RTX 4090","price_USD_max"] == 2000.0
+    assert aggregate.loc["RX 7900","offers"] == 1
+
+    # only recent rows stay in raw table, old ones are archived
+    assert read(engine_str,"SELECT price_USD FROM gpu_info")["price_USD"].tolist() == [950.0]
+    assert len(pd.read_csv(tmp_path / f"gpu_info_archive_{old_month:%Y%m}.csv")) == 3
+    assert database.apply_retention(12) == ""
+
+
+def test_backfilled_month_is_merged_into_existing_aggregate(engine_str,tmp_path):
+    database = GpuDatabase(engine_str=engine_str)
+    database.create_schema()
+    old_month = GpuDatabase.month_start(date.today(),-13)
+    database.load(offers(*[["RTX 4090",price,"ASUS",24.0,2500.0,str(old_month)] for price in [1000.0,1100.0,1200.0,1300.0,1400.0]]))
+    database.apply_retention(12)
+
+    # late merge of old snapshot recreates monthly table of already downsampled month
+    database.load(offers(["RTX 4090",999.0,"ASUS",16.0,None,str(old_month.replace(day=20))]))
+    assert "1 months" in database.apply_retention(12)
+
+    aggregate = read(engine_str,"SELECT * FROM gpu_info_monthly").iloc[0]
+    assert aggregate["offers"] == 6
+    assert aggregate["snapshots"] == 2
+    assert aggregate["price_USD_min"] == 999.0
+    assert aggregate["price_USD_max"] == 1400.0
+    assert aggregate["price_USD_avg"] == pytest.approx((1000 + 1100 + 1200 + 1300 + 1400 + 999)/6)
+    assert aggregate["ram_GB_avg"] == pytest.approx((24*5 + 16)/6)
+    assert aggregate["gpu_clock_speed_MHz_avg"] == 2500.0
+    # archived raw rows of both runs are kept
+    assert len(pd.read_csv(tmp_path / f"gpu_info_archive_{old_month:%Y%m}.csv")) == 6
@@ -0,0 +1,237 @@
+import pytest
+import requests
+import etl_process
+import distributed_process
+from distributed_process import CrawlQueue
+from etl_process import AmazonScrapeGPU
+
+# tests of the work queue and distributed workers, they use temporary SQLite file and mocked Amazon responses
+
+RUN_DATE = "2026-10-19"
+
+OFFER_LINK_HTML = """<div data-asin="{asin}" class="sg-col-20-of-24 s-result-item s-asin sg-col-0-of-12 sg-col-16-of-20 sg-col s-widget-spacing-small sg-col-12-of-16">
+<a href="/dp/{asin}">offer</a></div>"""
+
+OFFER_HTML = """<span class="a-price-whole">1,299.</span>
+<table class="a-normal a-spacing-micro">
+<tr class="a-spacing-small po-graphics_coprocessor"><td>Graphics Coprocessor</td><td>RTX 4090</td></tr>
+<tr class="a-spacing-small po-brand"><td>Brand</td><td>ASUS</td></tr>
+<tr class="a-spacing-small po-graphics_ram.size"><td>Graphics Ram Size</td><td>24 GB</td></tr>
+<tr class="a-spacing-small po-gpu_clock_speed"><td>GPU Clock Speed</td><td>2.5 GHz</td></tr>
+</table>"""
+
+
+def page_html(*asins):
+    offers = "".join(OFFER_LINK_HTML.format(asin=asin) for asin in asins)
+    return f'<div class="s-main-slot s-result-list s-search-results sg-row">{offers}</div>'
+
+
+def make_response(status_code,body=""):
+    response = requests.models.Response()
+    response.status_code = status_code
+    response.reason = "mocked"
+    response._content = body.encode()
+    return response
+
+
+class Clock():
+    # replaces time.time in distributed_process so lease expiry can be tested without waiting
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(distributed_process.time,"time",clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return CrawlQueue(f"sqlite:///{tmp_path / 'queue.db'}",max_attempts=2)
+
+
+@pytest.fixture
+def scraper(monkeypatch):
+    # no random breaks between requests
+    monkeypatch.setattr(etl_process.time,"sleep",lambda seconds: None)
+    scraper = AmazonScrapeGPU(email="test")
+    scraper.date = RUN_DATE
+    return scraper
+
+
+def test_seed_is_idempotent_and_builds_search_urls(queue):
+    assert queue.seed(["rtx 4090"],number_of_pages=2,run_date=RUN_DATE) == 2
+    assert queue.seed(["rtx 4090"],number_of_pages=2,run_date=RUN_DATE) == 0
+    item = queue.lease("w1")
+    assert item["url"].startswith("https://www.amazon.com/s?k=rtx+4090&i=electronics&page=")
+    assert queue.stats(RUN_DATE) == {"pending": 1, "leased": 1}
+
+
+def test_lease_prefers_pages_and_is_exclusive(queue):
+    queue.seed({"gpu": "https://example.com/s?k=gpu"},number_of_pages=1,run_date=RUN_DATE)
+    page = queue.lease("w1")
+    queue.put_offers(page,[("A1","https://example.com/a1"),("A2","https://example.com/a2")])
+    queue.seed({"gpu": "https://example.com/s?k=gpu"},number_of_pages=2,run_date=RUN_DATE)
+
+    # second page goes before offers, then each offer is given to only one worker
+    assert queue.lease("w2")["kind"] == "page"
+    leased = {queue.lease("w2")["asin"], queue.lease("w3")["asin"]}
+    assert leased == {"A1","A2"}
+    assert queue.lease("w4") is None
+
+
+def test_expired_lease_is_taken_over(queue,clock):
+    queue.seed(["gpu"],number_of_pages=1,run_date=RUN_DATE)
+    item = queue.lease("w1",visibility_timeout=10)
+    assert queue.lease("w2",visibility_timeout=10) is None
+
+    clock.now += 11
+    taken_over = queue.lease("w2",visibility_timeout=10)
+    assert taken_over["id"] == item["id"]
+    assert taken_over["attempts"] == 2
+
+    # late completion of the first worker is ignored
+    queue.complete(item["id"],"w1")
+    assert queue.stats() == {"leased": 1}
+    queue.complete(item["id"],"w2")
+    assert queue.stats() == {"done": 1}
+
+
+def test_expired_lease_without_attempts_left_fails(queue,clock):
+    queue.seed(["gpu"],number_of_pages=1,run_date=RUN_DATE)
+    queue.lease("w1",visibility_timeout=10)
+    clock.now += 11
+    queue.lease("w2",visibility_timeout=10)
+    clock.now += 11
+    assert queue.lease("w3") is None
+    assert queue.stats() == {"failed": 1}
+
+
+def test_fail_retries_until_max_attempts(queue):
+    queue.seed(["gpu"],number_of_pages=1,run_date=RUN_DATE)
+    item = queue.lease("w1")
+    queue.fail(item["id"],"w1","error")
+    assert queue.stats() == {"pending": 1}
+    item = queue.lease("w1")
+    queue.fail(item["id"],"w1","error")
+    assert queue.stats() == {"failed": 1}
+
+
+def test_fail_without_retry(queue):
+    queue.seed(["gpu"],number_of_pages=1,run_date=RUN_DATE)
+    item = queue.lease("w1")
+    queue.fail(item["id"],"w1","404",retry=False)
+    assert queue.stats() == {"failed": 1}
+
+
+def test_offers_and_results_are_deduplicated_by_asin_and_date(queue):
+    queue.seed({"a": "https://example.com/s?k=a", "b": "https://example.com/s?k=b"},number_of_pages=1,run_date=RUN_DATE)
+    first, second = queue.lease("w1"), queue.lease("w1")
+    assert queue.put_offers(first,[("A1","https://example.com/a1")]) == 1
+    assert queue.put_offers(second,[("A1","https://example.com/other-url")]) == 0
+
+    offer = queue.lease("w1")
+    row = ["RTX 4090","1,299.","ASUS","24 GB","2.5 GHz",RUN_DATE]
+    assert queue.add_result(offer,row)
+    assert not queue.add_result(offer,row)
+    frame = queue.results_frame(RUN_DATE)
+    assert list(frame.index) == ["A1"]
+    assert list(frame.columns) == ["model","price_USD","brand","ram_GB","gpu_clock_speed_MHz","date"]
+
+
+def test_worker_scrapes_pages_and_offers(queue,scraper,monkeypatch):
+    def get(url,headers=None):
+        if "/dp/" in url:
+            return make_response(200,OFFER_HTML)
+        return make_response(200,page_html("B0" + url[-1]))
+    monkeypatch.setattr(etl_process.requests,"get",get)
+
+    queue.seed({"gpu": "https://example.com/s?k=gpu"},number_of_pages=2,run_date=RUN_DATE)
+    scraper.run_worker(queue,"w1")
+    assert queue.stats() == {"done": 4}
+    frame = queue.results_frame(RUN_DATE)
+    assert sorted(frame.index) == ["B01","B02"]
+    assert frame.iloc[0].tolist() == ["RTX 4090","1,299.","ASUS","24 GB","2.5 GHz",RUN_DATE]
+
+
+def test_second_worker_takes_offers_expanded_by_first(queue,scraper,monkeypatch):
+    def get(url,headers=None):
+        if "/dp/" in url:
+            return make_response(200,OFFER_HTML)
+        return make_response(200,page_html("B01","B02","B03","B04"))
+    monkeypatch.setattr(etl_process.requests,"get",get)
+    queue.seed({"gpu": "https://example.com/s?k=gpu"},number_of_pages=1,run_date=RUN_DATE)
+
+    # first worker expands the page and is still working on one of the offers
+    scraper.run_worker(queue,"w1",max_items=1)
+    held = queue.lease("w1")
+
+    # second worker scrapes the rest and waits until first worker finishes instead of quitting
+    polls = []
+    def sleep(seconds):
+        # random breaks between requests are shorter than polling interval
+        if seconds == 60:
+            polls.append(seconds)
+            queue.complete(held["id"],"w1")
+    monkeypatch.setattr(etl_process.time,"sleep",sleep)
+    second = AmazonScrapeGPU(email="test")
+    second.run_worker(queue,"w2",run_date=RUN_DATE,poll_interval=60)
+    assert "processed 3 work items" in second.email_message
+    assert polls == [60]
+    assert queue.stats(RUN_DATE) == {"done": 5}
+
+
+@pytest.mark.parametrize("status_code",[401,403,503])
+def test_blocked_worker_stops(queue,scraper,monkeypatch,status_code):
+    monkeypatch.setattr(etl_process.requests,"get",lambda url,headers=None: make_response(status_code))
+    queue.seed(["gpu"],number_of_pages=20,run_date=RUN_DATE)
+    scraper.run_worker(queue,"w1")
+    # blocked page is returned to the queue and the rest is left for other workers
+    assert queue.stats() == {"pending": 20}
+    assert "access blocked" in scraper.email_message
+
+
+def test_worker_backs_off_after_errors(queue,scraper,monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(etl_process.time,"sleep",sleeps.append)
+    monkeypatch.setattr(etl_process.requests,"get",lambda url,headers=None: make_response(500))
+    queue.seed(["gpu"],number_of_pages=2,run_date=RUN_DATE)
+    scraper.run_worker(queue,"w1",backoff=5)
+    assert queue.stats() == {"failed": 2}
+    assert sleeps == [5,10,20,40]
+
+
+def test_pages_past_the_end_are_not_retried(queue,scraper,monkeypatch):
+    monkeypatch.setattr(etl_process.requests,"get",lambda url,headers=None: make_response(404))
+    queue.seed(["gpu"],number_of_pages=3,run_date=RUN_DATE)
+    scraper.run_worker(queue,"w1")
+    assert queue.stats() == {"failed": 3}
+
+
+def test_merge_is_refused_while_work_is_outstanding_and_not_repeated(queue,scraper,monkeypatch):
+    loaded = []
+    monkeypatch.setattr(scraper,"load_to_db",lambda data: loaded.append(data) or True)
+    monkeypatch.setattr(scraper,"send_email",lambda: None)
+
+    queue.seed(["gpu"],number_of_pages=1,run_date=RUN_DATE)
+    page = queue.lease("w1")
+    queue.put_offers(page,[("A1","https://example.com/a1")])
+    queue.complete(page["id"],"w1")
+    offer = queue.lease("w1")
+    queue.add_result(offer,["RTX 4090","1,299.","ASUS","24 GB","2.5 GHz",RUN_DATE])
+
+    scraper.run_merge_pipeline(queue)
+    assert loaded == []
+    assert "Merge refused" in scraper.email_message
+
+    queue.complete(offer["id"],"w1")
+    scraper.run_merge_pipeline(queue)
+    scraper.run_merge_pipeline(queue)
+    assert len(loaded) == 1
+    assert loaded[0]["price_USD"].tolist() == [1299.0]
+    assert queue.results_frame(RUN_DATE).empty